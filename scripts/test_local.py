@@ -4,12 +4,27 @@ Local Testing Script for VPS Configuration
 Rewritten in Python for better container management and waiting logic
 """
 
+import io
 import os
 import sys
+import json
 import time
+import atexit
+import shlex
+import shutil
+import socket
+import tarfile
+import threading
 import subprocess
+import http.client
+import urllib.parse
 import requests
+import urllib3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 # Color codes
 class Colors:
@@ -19,21 +34,40 @@ class Colors:
     BLUE = '\033[0;34m'
     NC = '\033[0m'  # No Color
 
+# Project paths, resolved once at import
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+ANSIBLE_DIR = PROJECT_ROOT / 'ansible'
+COMPOSE_DIR = PROJECT_ROOT / 'docker' / 'test-environment'
+TEST_INVENTORY = ANSIBLE_DIR / 'inventories' / 'test.yml'
+
+# Executables the test run shells out to
+REQUIRED_TOOLS = ("docker", "ansible", "ansible-playbook", "ssh-keygen", "ssh")
+
+# Shared HTTP session so endpoint probes reuse TCP/TLS connections
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
 def print_status(message, color=Colors.NC):
     print(f"{color}{message}{Colors.NC}")
 
-def run_command(command, cwd=None, check=True, timeout=300, verbose=False):
-    """Run a command and return the result"""
+def run_command(command, cwd=None, check=True, timeout=300, verbose=False, input=None, stream=False):
+    """Run a command (argv list, no shell) and return the result
+
+    With stream=True the output goes straight to the terminal instead of being
+    buffered, for long-running commands whose output isn't parsed.
+    """
+    command_line = shlex.join(str(arg) for arg in command)
     if verbose:
-        print_status(f"🔧 Running: {command}", Colors.BLUE)
+        print_status(f"🔧 Running: {command_line}", Colors.BLUE)
     
     try:
         result = subprocess.run(
             command, 
-            shell=True, 
             cwd=cwd, 
-            capture_output=True, 
-            text=True, 
+            input=input,
+            capture_output=not stream, 
+            text=not isinstance(input, bytes), 
             timeout=timeout,
             check=check
         )
@@ -47,79 +81,216 @@ def run_command(command, cwd=None, check=True, timeout=300, verbose=False):
         
         return result
     except subprocess.TimeoutExpired:
-        print_status(f"❌ Command timed out after {timeout}s: {command}", Colors.RED)
+        print_status(f"❌ Command timed out after {timeout}s: {command_line}", Colors.RED)
+        return None
+    except FileNotFoundError:
+        print_status(f"❌ Command not found: {command[0]}", Colors.RED)
         return None
     except subprocess.CalledProcessError as e:
         if check:
-            print_status(f"❌ Command failed: {command}", Colors.RED)
+            print_status(f"❌ Command failed: {command_line}", Colors.RED)
             print_status(f"   Error: {e.stderr}", Colors.RED)
             return None
         return e
 
+def output_contains(result, text):
+    """Check a captured command result for a substring (replaces piping through grep)"""
+    if not result or result.returncode != 0:
+        return False
+    matches = [line for line in result.stdout.splitlines() if text in line]
+    for line in matches:
+        print_status(f"   {line}", Colors.NC)
+    return bool(matches)
+
+@lru_cache(maxsize=None)
+def compose_command():
+    """Prefer the Compose v2 plugin (docker compose); fall back to legacy docker-compose if it's missing"""
+    result = run_command(["docker", "compose", "version"], timeout=10, check=False)
+    if result and result.returncode == 0:
+        return ["docker", "compose"]
+    if shutil.which('docker-compose'):
+        print_status("⚠️ docker compose plugin not found, using legacy docker-compose", Colors.YELLOW)
+        return ["docker-compose"]
+    return ["docker", "compose"]
+
+# Recent log lines of containers followed by start_log_tail, keyed by container name
+_log_tails = {}
+
+def start_log_tail(container_name, maxlen=500):
+    """Follow a container's logs in a background thread, keeping the last maxlen lines"""
+    lines = deque(maxlen=maxlen)
+    process = subprocess.Popen(
+        ["docker", "logs", "--follow", container_name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors='replace'
+    )
+    atexit.register(process.terminate)
+    
+    def _tail():
+        for line in process.stdout:
+            lines.append(line.rstrip('\n'))
+    
+    threading.Thread(target=_tail, daemon=True).start()
+    _log_tails[container_name] = lines
+
+def show_container_logs(container_name, tail):
+    """Print the last lines of a container's logs, from its background tail when there is one"""
+    lines = _log_tails.get(container_name)
+    if lines is None:
+        run_command(["docker", "logs", container_name, "--tail", str(tail)], check=False, verbose=True)
+        return
+    for line in list(lines)[-tail:]:
+        print_status(f"   {line}", Colors.NC)
+
+def run_diagnostics(container_name, commands, timeout=20):
+    """Run several diagnostic commands in one docker exec, tracing each one before its output"""
+    script = "exec 2>&1; set -x; " + "; ".join(commands)
+    return run_command(["docker", "exec", container_name, "bash", "-c", script], timeout=timeout, check=False, verbose=True)
+
+class DockerSocketConnection(http.client.HTTPConnection):
+    """HTTP connection to the Docker Engine API over its UNIX socket"""
+
+    def __init__(self, socket_path, timeout=10):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+@lru_cache(maxsize=None)
+def docker_socket_path():
+    """Resolve the Docker daemon socket from DOCKER_HOST or the active docker context (e.g. Colima)
+
+    Returns None when the daemon isn't reachable over a local UNIX socket
+    (tcp://, ssh:// hosts), in which case callers go through the docker CLI.
+    """
+    host = os.environ.get('DOCKER_HOST')
+    if not host:
+        result = run_command(["docker", "context", "inspect", "--format", "{{.Endpoints.docker.Host}}"], check=False)
+        if result and result.returncode == 0:
+            host = result.stdout.strip()
+    if host:
+        return host[len('unix://'):] if host.startswith('unix://') else None
+    return '/var/run/docker.sock' if os.path.exists('/var/run/docker.sock') else None
+
+def docker_api_get(path, timeout=10):
+    """GET a Docker Engine API path and return (status, decoded JSON body)"""
+    connection = DockerSocketConnection(docker_socket_path(), timeout=timeout)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, json.loads(body) if body else None
+    finally:
+        connection.close()
+
+def container_state(container_name):
+    """Return the container's State from the Engine API, or None if it does not exist"""
+    if docker_socket_path() is None:
+        # No local socket to talk to, let the CLI reach the daemon however it is configured
+        result = run_command(["docker", "inspect", "--format", "{{json .State}}", container_name], check=False)
+        if not result or result.returncode != 0:
+            return None
+        return json.loads(result.stdout)
+    
+    status, info = docker_api_get(f"/containers/{container_name}/json")
+    if status == 404:
+        return None
+    return info['State']
+
+def container_ready(state):
+    """A container is ready once its HEALTHCHECK passes, or once running if it has none"""
+    if state is None or not state['Running']:
+        return False
+    if 'Health' in state:
+        return state['Health']['Status'] == 'healthy'
+    return True
+
+def container_stopped(state):
+    return state is not None and state['Status'] in ('exited', 'dead')
+
+def wait_for_health_event(container_name, timeout):
+    """Block on the Engine API events stream until the container becomes ready or dies
+
+    Returns True when ready, False when the container died, and None if the
+    stream ended (timeout or dropped connection) without either happening, or
+    if there is no local socket to stream from.
+    """
+    if docker_socket_path() is None:
+        return None
+    
+    filters = json.dumps({"container": [container_name], "event": ["health_status", "die"]})
+    query = urllib.parse.urlencode({"filters": filters, "until": int(time.time() + timeout)})
+    connection = DockerSocketConnection(docker_socket_path(), timeout=timeout + 10)
+    try:
+        connection.request('GET', f"/events?{query}")
+        response = connection.getresponse()
+        
+        # Subscribed first, so a transition between this check and the stream can't be missed
+        state = container_state(container_name)
+        if container_ready(state):
+            return True
+        if container_stopped(state):
+            return False
+        
+        for line in response:
+            if not line.strip():
+                continue
+            action = json.loads(line).get('Action', '')
+            if action == 'health_status: healthy':
+                return True
+            if action == 'die':
+                return False
+            print_status(f"   Container {action}", Colors.YELLOW)
+        return None
+    finally:
+        connection.close()
+
 def wait_for_container_healthy(container_name, timeout=120):
-    """Wait for container to be healthy and running using docker CLI"""
+    """Wait for container to be healthy and running using the Docker Engine API"""
     print_status(f"⏳ Waiting for {container_name} to be ready...", Colors.YELLOW)
     
-    start_time = time.time()
+    deadline = time.monotonic() + timeout
+    
+    # Edge-triggered: wait for the daemon to push the health_status/die event
+    try:
+        ready = wait_for_health_event(container_name, timeout)
+    except Exception as e:
+        print_status(f"   Events stream unavailable ({e}), falling back to polling", Colors.YELLOW)
+        ready = None
     
-    while time.time() - start_time < timeout:
+    # Level-triggered fallback for the remaining time if the events stream dropped
+    while ready is None and time.monotonic() < deadline:
         try:
-            # Check if container exists and is running
-            result = run_command(f"docker ps --filter name={container_name} --format '{{{{.Status}}}}'", check=False)
-            if not result or not result.stdout.strip():
-                # Check if container exists but is stopped
-                stopped_result = run_command(f"docker ps -a --filter name={container_name} --format '{{{{.Status}}}}'", check=False)
-                if stopped_result and stopped_result.stdout.strip():
-                    print_status(f"❌ Container {container_name} exists but stopped: {stopped_result.stdout.strip()}", Colors.RED)
-                    # Get container logs to see why it stopped
-                    print_status("📋 Container logs:", Colors.YELLOW)
-                    run_command(f"docker logs {container_name} --tail 20", check=False, verbose=True)
-                    return False
-                else:
-                    print_status(f"   Container {container_name} not found, waiting...", Colors.YELLOW)
-                time.sleep(3)
-                continue
-            
-            status = result.stdout.strip()
-            if not status.startswith('Up'):
-                print_status(f"   Container status: {status}", Colors.YELLOW)
-                
-                # If container is exited, show logs and fail
-                if 'Exited' in status:
-                    print_status(f"❌ Container {container_name} has exited: {status}", Colors.RED)
-                    print_status("📋 Container logs:", Colors.YELLOW)
-                    run_command(f"docker logs {container_name} --tail 30", check=False, verbose=True)
-                    return False
-                    
-                time.sleep(2)
-                continue
-            
-            # For systemd containers, check if systemd is ready
-            if container_name == 'test-vps':
-                try:
-                    result = run_command(
-                        f"docker exec {container_name} systemctl is-system-running --wait", 
-                        timeout=10, 
-                        check=False
-                    )
-                    if result and result.returncode in [0, 1]:  # 0 = running, 1 = degraded (still ok)
-                        print_status(f"✅ {container_name} systemd is ready", Colors.GREEN)
-                        return True
-                    else:
-                        print_status(f"   Systemd status: {result.returncode if result else 'timeout'}", Colors.YELLOW)
-                except Exception as e:
-                    print_status(f"   Systemd check: {e}", Colors.YELLOW)
-            
-            # For other containers, just check if they're running
+            state = container_state(container_name)
+            if container_ready(state) or container_stopped(state):
+                ready = container_ready(state)
+                break
+            if state is None:
+                print_status(f"   Container {container_name} not found, waiting...", Colors.YELLOW)
+            elif 'Health' in state:
+                print_status(f"   Container health: {state['Health']['Status']}", Colors.YELLOW)
             else:
-                print_status(f"✅ {container_name} is running", Colors.GREEN)
-                return True
-                
+                print_status(f"   Container status: {state['Status']}", Colors.YELLOW)
         except Exception as e:
             print_status(f"   Checking container: {e}", Colors.YELLOW)
         
         time.sleep(3)
     
+    if ready:
+        print_status(f"✅ {container_name} is ready", Colors.GREEN)
+        return True
+    
+    if ready is False:
+        print_status(f"❌ Container {container_name} has exited", Colors.RED)
+        print_status("📋 Container logs:", Colors.YELLOW)
+        show_container_logs(container_name, tail=30)
+        return False
+    
     print_status(f"❌ {container_name} did not become ready within {timeout}s", Colors.RED)
     return False
 
@@ -127,14 +298,14 @@ def wait_for_ssh_service(container_name, timeout=60):
     """Wait for SSH service to be ready inside container using docker CLI"""
     print_status("🔐 Waiting for SSH service...", Colors.YELLOW)
     
-    start_time = time.time()
+    deadline = time.monotonic() + timeout
     
-    while time.time() - start_time < timeout:
+    while time.monotonic() < deadline:
         try:
             # First check if SSH service is active
             print_status("   Checking SSH service status...", Colors.YELLOW)
             result = run_command(
-                f"docker exec {container_name} systemctl is-active ssh", 
+                ["docker", "exec", container_name, "systemctl", "is-active", "ssh"],
                 timeout=5, 
                 check=False,
                 verbose=True
@@ -144,12 +315,11 @@ def wait_for_ssh_service(container_name, timeout=60):
                 # Also check if SSH is listening on port 22
                 print_status("   SSH is active, checking port 22...", Colors.YELLOW)
                 port_check = run_command(
-                    f"docker exec {container_name} netstat -tlnp | grep :22", 
+                    ["docker", "exec", container_name, "netstat", "-tlnp"],
                     timeout=5, 
-                    check=False,
-                    verbose=True
+                    check=False
                 )
-                if port_check and port_check.returncode == 0:
+                if output_contains(port_check, ":22"):
                     print_status("✅ SSH service is active and listening", Colors.GREEN)
                     return True
                 else:
@@ -158,7 +328,7 @@ def wait_for_ssh_service(container_name, timeout=60):
                 # Try to start SSH if it's not running
                 print_status("   SSH not active, attempting to start...", Colors.YELLOW)
                 start_result = run_command(
-                    f"docker exec {container_name} systemctl start ssh", 
+                    ["docker", "exec", container_name, "systemctl", "start", "ssh"],
                     timeout=10, 
                     check=False,
                     verbose=True
@@ -167,7 +337,7 @@ def wait_for_ssh_service(container_name, timeout=60):
                 # Check what happened with the start command
                 if start_result:
                     status_result = run_command(
-                        f"docker exec {container_name} systemctl status ssh --no-pager", 
+                        ["docker", "exec", container_name, "systemctl", "status", "ssh", "--no-pager"],
                         timeout=5, 
                         check=False,
                         verbose=True
@@ -179,23 +349,38 @@ def wait_for_ssh_service(container_name, timeout=60):
         time.sleep(3)
     
     # Final diagnostic info
+    # Service state, installation and configuration, collected in a single exec
     print_status("📋 Final SSH service diagnostics:", Colors.YELLOW)
-    run_command(f"docker exec {container_name} systemctl status ssh --no-pager -l", timeout=10, check=False, verbose=True)
-    run_command(f"docker exec {container_name} journalctl -u ssh --no-pager -n 20", timeout=10, check=False, verbose=True)
-    
-    # Check if SSH daemon is installed
-    print_status("📋 Checking SSH installation:", Colors.YELLOW)
-    run_command(f"docker exec {container_name} which sshd", timeout=5, check=False, verbose=True)
-    run_command(f"docker exec {container_name} dpkg -l | grep openssh", timeout=5, check=False, verbose=True)
-    
-    # Check SSH configuration
-    print_status("📋 Checking SSH config:", Colors.YELLOW)
-    run_command(f"docker exec {container_name} ls -la /etc/ssh/", timeout=5, check=False, verbose=True)
-    run_command(f"docker exec {container_name} sshd -T", timeout=5, check=False, verbose=True)
+    run_diagnostics(container_name, [
+        "systemctl status ssh --no-pager -l",
+        "journalctl -u ssh --no-pager -n 20",
+        "which sshd",
+        "dpkg -l | grep openssh",
+        "ls -la /etc/ssh/",
+        "sshd -T",
+    ])
     
     print_status(f"❌ SSH service not ready within {timeout}s", Colors.RED)
     return False
 
+def authorized_keys_archive(pub_key):
+    """Build an in-memory tar of .ssh/authorized_keys with the modes sshd expects"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        ssh_dir = tarfile.TarInfo('.ssh')
+        ssh_dir.type = tarfile.DIRTYPE
+        ssh_dir.mode = 0o700
+        ssh_dir.mtime = int(time.time())
+        archive.addfile(ssh_dir)
+        
+        data = f"{pub_key}\n".encode()
+        key_file = tarfile.TarInfo('.ssh/authorized_keys')
+        key_file.size = len(data)
+        key_file.mode = 0o600
+        key_file.mtime = ssh_dir.mtime
+        archive.addfile(key_file, io.BytesIO(data))
+    return buffer.getvalue()
+
 def setup_ssh_access():
     """Setup SSH key and access using docker CLI"""
     print_status("🔑 Setting up SSH access...", Colors.YELLOW)
@@ -205,23 +390,20 @@ def setup_ssh_access():
     # Generate SSH key if doesn't exist
     if not ssh_key_path.exists():
         print_status("🔑 Generating SSH key...", Colors.YELLOW)
-        result = run_command(f'ssh-keygen -t rsa -b 2048 -f {ssh_key_path} -N ""')
+        result = run_command(["ssh-keygen", "-t", "rsa", "-b", "2048", "-f", str(ssh_key_path), "-N", ""])
         if not result:
             return False
     
     # Copy SSH key to container using docker CLI
     try:
-        # Create .ssh directory
-        run_command("docker exec test-vps mkdir -p /root/.ssh")
-        
-        # Copy public key
         with open(f"{ssh_key_path}.pub", 'r') as f:
             pub_key = f.read().strip()
         
-        # Use docker exec to set up authorized_keys
-        run_command(f"docker exec test-vps bash -c 'echo \"{pub_key}\" > /root/.ssh/authorized_keys'")
-        run_command("docker exec test-vps chmod 600 /root/.ssh/authorized_keys")
-        run_command("docker exec test-vps chown root:root /root/.ssh/authorized_keys")
+        # Stream .ssh/authorized_keys into /root as a tar archive: no shell in the
+        # container, no quoting of the key, and docker cp creates it as root:root
+        result = run_command(["docker", "cp", "-", "test-vps:/root"], input=authorized_keys_archive(pub_key))
+        if not result:
+            return False
         
         print_status("✅ SSH access configured", Colors.GREEN)
         return True
@@ -233,7 +415,7 @@ def setup_ssh_access():
 def test_http_endpoint(url, expected_text=None, timeout=10):
     """Test if HTTP endpoint is responding"""
     try:
-        response = requests.get(url, verify=False, timeout=timeout)
+        response = _SESSION.get(url, verify=False, timeout=timeout)
         if response.status_code == 200:
             if expected_text and expected_text.lower() in response.text.lower():
                 return True
@@ -243,12 +425,79 @@ def test_http_endpoint(url, expected_text=None, timeout=10):
     except Exception:
         return False
 
+def wait_for_endpoints(endpoints, overall_timeout=60):
+    """Probe endpoints until all respond or the timeout expires; return the names that responded"""
+    pending = list(endpoints)
+    ready = set()
+    deadline = time.monotonic() + overall_timeout
+    
+    # Probe all pending endpoints concurrently so one slow service doesn't hold up the others
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        while pending and time.monotonic() < deadline:
+            results = list(executor.map(
+                lambda endpoint: test_http_endpoint(endpoint[0], endpoint[2], timeout=1),
+                pending
+            ))
+            for endpoint, ok in zip(list(pending), results):
+                if ok:
+                    ready.add(endpoint[1])
+                    pending.remove(endpoint)
+            if pending:
+                time.sleep(0.5)
+    
+    return ready
+
+def check_ansible_connectivity(inventory):
+    """Ping the test host through Ansible"""
+    print_status("📡 Testing Ansible connectivity...", Colors.YELLOW)
+    result = run_command(["ansible", "vps", "-i", inventory, "-m", "ping", "-vvv"], cwd=ANSIBLE_DIR, check=False, verbose=True, stream=True)
+    if not result or result.returncode != 0:
+        print_status("❌ Connectivity test failed", Colors.RED)
+        return False
+    
+    print_status("✅ Connectivity test passed", Colors.GREEN)
+    return True
+
+def debug_ssh_connectivity():
+    """Print SSH diagnostics for an unreachable test container"""
+    # Debug SSH connection manually
+    print_status("🔍 Debugging SSH connection...", Colors.YELLOW)
+    run_command(["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-p", "2222", "root@localhost", "echo SSH connection works"], check=False, verbose=True)
+    
+    # Check if container is still running
+    print_status("🔍 Checking container status...", Colors.YELLOW)
+    run_command(["docker", "ps", "--filter", "name=test-vps", "--format", "table {{.Names}}\t{{.Status}}\t{{.Ports}}"], check=False, verbose=True)
+    
+    # Check Docker port mapping
+    print_status("🔍 Checking Docker port mapping...", Colors.YELLOW)
+    run_command(["docker", "port", "test-vps"], check=False, verbose=True)
+    
+    # Check key setup, sshd config, listening port and direct SSH inside the container
+    print_status("🔍 Checking SSH inside container...", Colors.YELLOW)
+    run_diagnostics("test-vps", [
+        "cat /root/.ssh/authorized_keys",
+        "grep -E '(PermitRootLogin|PubkeyAuthentication)' /etc/ssh/sshd_config",
+        "netstat -tlnp | grep :22",
+        "ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null root@localhost 'echo Direct SSH works'",
+    ])
+
 def main():
     print_status("🧪 Starting local testing environment...", Colors.BLUE)
     
+    # Fail fast, before any container is built, if the test inventory is missing
+    if not TEST_INVENTORY.is_file():
+        print_status(f"❌ Inventory file not found: {TEST_INVENTORY}", Colors.RED)
+        sys.exit(1)
+    inventory = str(TEST_INVENTORY)
+    
+    missing = [tool for tool in REQUIRED_TOOLS if shutil.which(tool) is None]
+    if missing:
+        print_status(f"❌ Required tools not found in PATH: {', '.join(missing)}", Colors.RED)
+        sys.exit(1)
+    
     # Check if Docker is running using CLI
     try:
-        result = run_command("docker info", timeout=10)
+        result = run_command(["docker", "info"], timeout=10)
         if result and result.returncode == 0:
             print_status("✅ Docker CLI is working", Colors.GREEN)
         else:
@@ -259,33 +508,34 @@ def main():
         sys.exit(1)
     
     # Change to project root
-    project_root = Path(__file__).parent.parent
-    os.chdir(project_root)
+    os.chdir(PROJECT_ROOT)
     
     # Build and start test environment
     print_status("🏗️ Building test environment...", Colors.YELLOW)
-    compose_dir = project_root / 'docker' / 'test-environment'
     
     # Clean up any existing containers
-    run_command("docker-compose down --remove-orphans", cwd=compose_dir, check=False)
+    run_command([*compose_command(), "down", "--remove-orphans"], cwd=COMPOSE_DIR, check=False)
     
     # Build and start
-    result = run_command("docker-compose up -d --build", cwd=compose_dir)
+    result = run_command([*compose_command(), "up", "-d", "--build"], cwd=COMPOSE_DIR)
     if not result:
         print_status("❌ Failed to start test environment", Colors.RED)
         sys.exit(1)
     
+    # Capture the container's logs from boot onwards for failure reports
+    start_log_tail('test-vps')
+    
     # Wait for container to be healthy
     if not wait_for_container_healthy('test-vps', timeout=180):
         print_status("❌ Test container failed to start properly", Colors.RED)
         print_status("📋 Container logs:", Colors.YELLOW)
-        run_command("docker-compose logs --tail 50", cwd=compose_dir, check=False, verbose=True)
+        show_container_logs('test-vps', tail=50)
         
         print_status("📋 Container status:", Colors.YELLOW)
-        run_command("docker ps -a --filter name=test-vps", check=False, verbose=True)
+        run_command(["docker", "ps", "-a", "--filter", "name=test-vps"], check=False, verbose=True)
         
         print_status("📋 Docker events:", Colors.YELLOW)
-        run_command("docker events --since 5m --filter container=test-vps", check=False, verbose=True)
+        run_command(["docker", "events", "--since", "5m", "--filter", "container=test-vps"], check=False, verbose=True)
         
         sys.exit(1)
     
@@ -304,57 +554,24 @@ def main():
     
     # Run Ansible deployment
     print_status("🚀 Running Ansible deployment on test environment...", Colors.BLUE)
-    ansible_dir = project_root / 'ansible'
-    
-    # Test connectivity first
-    print_status("📡 Testing Ansible connectivity...", Colors.YELLOW)
-    result = run_command("ansible vps -i inventories/test.yml -m ping -vvv", cwd=ansible_dir, check=False, verbose=True)
-    if not result or result.returncode != 0:
-        print_status("❌ Connectivity test failed", Colors.RED)
-        
-        # Debug SSH connection manually
-        print_status("🔍 Debugging SSH connection...", Colors.YELLOW)
-        run_command("ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -p 2222 root@localhost 'echo SSH connection works'", check=False, verbose=True)
-        
-        # Check if SSH key is properly set up
-        print_status("🔍 Checking SSH key setup...", Colors.YELLOW)
-        run_command("docker exec test-vps cat /root/.ssh/authorized_keys", check=False, verbose=True)
-        
-        # Check SSH daemon configuration
-        print_status("🔍 Checking SSH daemon config...", Colors.YELLOW)
-        run_command("docker exec test-vps grep -E '(PermitRootLogin|PubkeyAuthentication)' /etc/ssh/sshd_config", check=False, verbose=True)
-        
-        # Check if container is still running
-        print_status("🔍 Checking container status...", Colors.YELLOW)
-        run_command("docker ps --filter name=test-vps --format 'table {{.Names}}\t{{.Status}}\t{{.Ports}}'", check=False, verbose=True)
-        
-        # Check if SSH is still listening inside container
-        print_status("🔍 Checking SSH inside container...", Colors.YELLOW)
-        run_command("docker exec test-vps netstat -tlnp | grep :22", check=False, verbose=True)
-        
-        # Check Docker port mapping
-        print_status("🔍 Checking Docker port mapping...", Colors.YELLOW)
-        run_command("docker port test-vps", check=False, verbose=True)
-        
-        # Test direct container connection
-        print_status("🔍 Testing direct container SSH...", Colors.YELLOW)
-        run_command("docker exec test-vps ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null root@localhost 'echo Direct SSH works'", check=False, verbose=True)
-        
-        sys.exit(1)
-    
-    print_status("✅ Connectivity test passed", Colors.GREEN)
     
     # Run the playbook
     print_status("🔧 Deploying configuration...", Colors.BLUE)
     result = run_command(
-        "ansible-playbook playbooks/site.yml -i inventories/test.yml -v", 
-        cwd=ansible_dir,
+        ["ansible-playbook", "playbooks/site.yml", "-i", inventory, "-v"],
+        cwd=ANSIBLE_DIR,
         timeout=600,  # 10 minutes for deployment
         check=False,
-        verbose=True
+        verbose=True,
+        stream=True
     )
     if not result or result.returncode != 0:
         print_status("❌ Deployment failed", Colors.RED)
+        
+        # The playbook is the connectivity test on the happy path; only dig into
+        # SSH when it fails and the host turns out to be unreachable
+        if not check_ansible_connectivity(inventory):
+            debug_ssh_connectivity()
         sys.exit(1)
     
     print_status("✅ Deployment successful", Colors.GREEN)
@@ -362,19 +579,15 @@ def main():
     # Test services
     print_status("🔍 Testing deployed services...", Colors.BLUE)
     
-    # Wait for services to start
-    print_status("⏳ Waiting for services to start...", Colors.YELLOW)
-    time.sleep(30)
-    
     # Check if containers are running
     print_status("🐳 Checking Docker containers...", Colors.YELLOW)
     result = run_command(
-        'ansible vps -i inventories/test.yml -m shell -a "docker ps --format \'table {{.Names}}\\t{{.Status}}\'"', 
-        cwd=ansible_dir
+        ["ansible", "vps", "-i", inventory, "-m", "shell", "-a", "docker ps --format 'table {{.Names}}\\t{{.Status}}'"],
+        cwd=ANSIBLE_DIR
     )
     
-    # Test HTTP endpoints
-    print_status("🌐 Testing HTTP endpoints...", Colors.YELLOW)
+    # Test HTTP endpoints, polling until they come up instead of sleeping a fixed time
+    print_status("🌐 Waiting for HTTP endpoints...", Colors.YELLOW)
     
     endpoints = [
         ("https://localhost:3001", "Grafana", "grafana"),
@@ -382,8 +595,9 @@ def main():
         ("https://localhost:3101", "Loki", None)
     ]
     
+    ready = wait_for_endpoints(endpoints, overall_timeout=60)
     for url, name, expected_text in endpoints:
-        if test_http_endpoint(url, expected_text, timeout=15):
+        if name in ready:
             print_status(f"✅ {name} is responding", Colors.GREEN)
         else:
             print_status(f"⚠️ {name} test inconclusive (might need more startup time)", Colors.YELLOW)
@@ -396,7 +610,7 @@ def main():
     print_status("  • Loki: https://localhost:3101", Colors.NC)
     
     print_status(f"\n{Colors.YELLOW}To clean up test environment:{Colors.NC}")
-    print_status("  cd docker/test-environment && docker-compose down", Colors.NC)
+    print_status(f"  cd docker/test-environment && {' '.join(compose_command())} down", Colors.NC)
     
     print_status(f"\n✅ Configuration is ready for production deployment!", Colors.GREEN)
 
@@ -4,148 +4,218 @@ Infrastructure Health Check Script
 Python version of the bash health check script using uv
 """
 
+import io
+import os
 import sys
-import subprocess
+import json
 import argparse
+import tempfile
+import subprocess
+import yaml
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 # Color codes
-class Colors:
-    RED = '\033[0;31m'
-    GREEN = '\033[0;32m'
-    YELLOW = '\033[1;33m'
-    BLUE = '\033[0;34m'
-    NC = '\033[0m'
+RED = '\033[0;31m'
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'
 
-def print_colored(message: str, color: str = Colors.NC):
-    print(f"{color}{message}{Colors.NC}")
+# Project paths, resolved once at import
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+ANSIBLE_DIR = PROJECT_ROOT / "ansible"
 
-def run_ansible_command(command: str, inventory_file: Path, cwd: Optional[Path] = None) -> bool:
-    """Run an Ansible command and return success status"""
-    full_command = f"ansible {command} -i {inventory_file.name}"
-    
-    try:
-        result = subprocess.run(
-            full_command,
-            shell=True,
-            cwd=cwd,
-            text=True,
-            check=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print_colored(f"❌ Command failed: {full_command}", Colors.RED)
-        return False
+# Check categories in report order: (category, check name, header)
+CATEGORIES = (
+    ("connectivity", "connectivity", "📡 Checking server connectivity..."),
+    ("resources", "system resources", "💾 Checking system resources..."),
+    ("services", "services", "🔧 Checking critical services..."),
+    ("docker", "docker containers", "🐳 Checking Docker containers..."),
+    ("endpoints", "monitoring endpoints", "📊 Checking monitoring endpoints..."),
+)
 
-def check_connectivity(environment: str, ansible_dir: Path) -> bool:
-    """Check if servers are reachable"""
-    print_colored("📡 Checking server connectivity...", Colors.BLUE)
-    
-    inventory_file = ansible_dir / f"inventories/{environment}.yml"
-    
-    if not inventory_file.exists():
-        print_colored(f"❌ Inventory file not found: {inventory_file}", Colors.RED)
-        return False
-    
-    return run_ansible_command("all -m ping", inventory_file, ansible_dir)
+# One row per probe: (category, description, module, module args, fail mode).
+# Module args are a dict, or a string for free-form shell commands; a "warn"
+# probe only prints a warning instead of failing its check
+CHECKS = (
+    ("connectivity", "ping", "ping", {}, "fail"),
+    ("resources", "disk usage", "shell", "df -h | head -5", "fail"),
+    ("resources", "memory usage", "shell", "free -h", "fail"),
+    ("resources", "system uptime", "shell", "uptime", "fail"),
+    ("resources", "load average", "shell", "cat /proc/loadavg", "fail"),
+    ("services", "SSH service", "service", {"name": "ssh", "state": "started"}, "fail"),
+    ("services", "Docker service", "service", {"name": "docker", "state": "started"}, "fail"),
+    ("docker", "container status", "shell", "docker ps --format 'table {{.Names}}\\t{{.Status}}\\t{{.Ports}}'", "fail"),
+    ("docker", "container health", "shell", "docker ps --filter health=healthy --format 'table {{.Names}}\\t{{.Status}}'", "fail"),
+    ("endpoints", "Grafana (port 3000)", "uri", {"url": "http://localhost:3000/api/health", "timeout": 10}, "warn"),
+    ("endpoints", "Prometheus (port 9090)", "uri", {"url": "http://localhost:9090/-/ready", "timeout": 10}, "warn"),
+    ("endpoints", "Loki (port 3100)", "uri", {"url": "http://localhost:3100/ready", "timeout": 10}, "warn"),
+)
 
-def check_system_resources(environment: str, ansible_dir: Path) -> bool:
-    """Check system resources on all servers"""
-    print_colored("💾 Checking system resources...", Colors.BLUE)
-    
-    inventory_file = ansible_dir / f"inventories/{environment}.yml"
-    
-    if not inventory_file.exists():
-        print_colored(f"❌ Inventory file not found: {inventory_file}", Colors.RED)
-        return False
-    
-    commands = [
-        ('disk usage', 'all -m shell -a "df -h | head -5"'),
-        ('memory usage', 'all -m shell -a "free -h"'),
-        ('system uptime', 'all -m shell -a "uptime"'),
-        ('load average', 'all -m shell -a "cat /proc/loadavg"')
-    ]
-    
-    success = True
-    for description, command in commands:
-        print_colored(f"  Checking {description}...", Colors.YELLOW)
-        if not run_ansible_command(command, inventory_file, ansible_dir):
-            success = False
-    
-    return success
+# Keep a persistent SSH master per host (reused by later health-check runs) and
+# pipe modules over it instead of copying a temp file for every task
+ANSIBLE_SSH_ENV = {
+    "ANSIBLE_SSH_ARGS": "-o ControlMaster=auto -o ControlPersist=600s",
+    "ANSIBLE_PIPELINING": "True",
+    "ANSIBLE_HOST_KEY_CHECKING": "False",
+}
 
-def check_services(environment: str, ansible_dir: Path) -> bool:
-    """Check critical services"""
-    print_colored("🔧 Checking critical services...", Colors.BLUE)
-    
-    inventory_file = ansible_dir / f"inventories/{environment}.yml"
-    
-    if not inventory_file.exists():
-        print_colored(f"❌ Inventory file not found: {inventory_file}", Colors.RED)
-        return False
-    
-    services = [
-        ('SSH service', 'all -m service -a "name=ssh state=started"'),
-        ('Docker service', 'all -m service -a "name=docker state=started"'),
-    ]
-    
-    success = True
-    for description, command in services:
-        print_colored(f"  Checking {description}...", Colors.YELLOW)
-        if not run_ansible_command(command, inventory_file, ansible_dir):
-            success = False
-    
-    return success
+# Fixed ansible-playbook options, built once at import; one fork per CPU so
+# multi-host inventories are probed in parallel
+ANSIBLE_PLAYBOOK_OPTIONS = ("--forks", str(os.cpu_count() or 8))
 
-def check_docker_containers(environment: str, ansible_dir: Path) -> bool:
-    """Check Docker containers status"""
-    print_colored("🐳 Checking Docker containers...", Colors.BLUE)
-    
-    inventory_file = ansible_dir / f"inventories/{environment}.yml"
-    
-    if not inventory_file.exists():
-        print_colored(f"❌ Inventory file not found: {inventory_file}", Colors.RED)
-        return False
-    
-    commands = [
-        ('container status', 'all -m shell -a "docker ps --format \'table {{.Names}}\\t{{.Status}}\\t{{.Ports}}\'"'),
-        ('container health', 'all -m shell -a "docker ps --filter health=healthy --format \'table {{.Names}}\\t{{.Status}}\'"'),
-    ]
-    
-    success = True
-    for description, command in commands:
-        print_colored(f"  Checking {description}...", Colors.YELLOW)
-        if not run_ansible_command(command, inventory_file, ansible_dir):
-            success = False
+# Report lines are collected here and written out once per section
+_output = io.StringIO()
+
+def print_colored(message: str, color: str = NC):
+    _output.write(f"{color}{message}{NC}\n")
+
+def flush_output():
+    """Write the buffered section to stdout in one go"""
+    sys.stdout.write(_output.getvalue())
+    sys.stdout.flush()
+    _output.seek(0)
+    _output.truncate()
+
+def probe_task_name(category: str, description: str) -> str:
+    return f"{category}: {description}"
+
+def task_args(module_args):
+    """Render a probe's module args for the playbook
+    
+    Structured args go in as-is; free-form shell commands are wrapped in raw so
+    docker's {{.Names}} format strings stay away from Jinja.
+    """
+    if isinstance(module_args, str):
+        return f"{{% raw %}}{module_args}{{% endraw %}}"
+    return module_args
+
+def describe_args(module_args) -> str:
+    """Format a probe's module args for the report"""
+    if isinstance(module_args, str):
+        return module_args
+    return " ".join(f"{key}={value}" for key, value in module_args.items())
+
+def build_health_playbook(rows) -> List[dict]:
+    """Build one playbook holding every probe row as a task tagged with its category"""
+    tasks = []
+    for category, description, module, module_args, _ in rows:
+        tasks.append({
+            'name': probe_task_name(category, description),
+            module: task_args(module_args),
+            'tags': [category],
+            # Keep going so every probe reports, pass/fail is read from the results
+            'ignore_errors': True,
+        })
+    
+    return [{
+        'name': 'Health checks',
+        'hosts': 'all',
+        'gather_facts': False,
+        'tasks': tasks,
+    }]
+
+def run_health_playbook(rows, inventory_path: str, ansible_dir: str) -> Optional[dict]:
+    """Run all selected probes in a single ansible-playbook call and return its JSON results"""
+    tags = ",".join(sorted({row[0] for row in rows}))
+    env = {**os.environ, **ANSIBLE_SSH_ENV, "ANSIBLE_STDOUT_CALLBACK": "json"}
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', prefix='health-check-') as playbook:
+        yaml.safe_dump(build_health_playbook(rows), playbook, sort_keys=False)
+        playbook.flush()
+        
+        command = ["ansible-playbook", playbook.name, "-i", inventory_path, "-t", tags, *ANSIBLE_PLAYBOOK_OPTIONS]
+        try:
+            result = subprocess.run(command, cwd=ansible_dir, env=env, capture_output=True, text=True)
+        except OSError as e:
+            print_colored(f"❌ Command failed: {' '.join(command)}", RED)
+            print_colored(str(e), RED)
+            return None
     
-    return success
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        print_colored(f"❌ Command failed: {' '.join(command)}", RED)
+        print_colored(result.stdout.strip(), NC)
+        print_colored(result.stderr.strip(), RED)
+        return None
+
+def collect_task_results(results: dict) -> Tuple[Dict[str, Dict[str, dict]], List[str], Set[str]]:
+    """Map each task name to its per-host results, list every host in the run and
+    collect the hosts that went unreachable"""
+    task_results = {}
+    for play in results.get('plays', []):
+        for task in play.get('tasks', []):
+            task_results[task['task']['name']] = task['hosts']
+    stats = results.get('stats', {})
+    unreachable = {host for host, counts in stats.items() if counts.get('unreachable')}
+    return task_results, sorted(stats), unreachable
 
-def check_monitoring_endpoints(environment: str, ansible_dir: Path) -> bool:
-    """Check monitoring service endpoints"""
-    print_colored("📊 Checking monitoring endpoints...", Colors.BLUE)
+def describe_result(result: dict) -> str:
+    """Pick the useful part of a module result for display"""
+    if result.get('unreachable') or result.get('failed'):
+        return result.get('msg') or result.get('stderr') or 'failed'
+    for key in ('stdout', 'ping', 'state', 'status'):
+        if result.get(key):
+            return str(result[key])
+    return 'ok'
+
+def report_probe(row, task_results: Dict[str, Dict[str, dict]], hosts: List[str], unreachable: Set[str]) -> bool:
+    """Print one probe's per-host results and return whether it passed"""
+    category, description, module, module_args, fail_mode = row
+    print_colored(f"  Checking {description}...", YELLOW)
+    host_results = task_results.get(probe_task_name(category, description), {})
+    
+    probe_ok = bool(hosts)
+    for host in hosts:
+        # Ansible drops a host from the rest of the play once it is unreachable,
+        # so later probes never ran against it; report them as skipped
+        if host not in host_results and host in unreachable:
+            print_colored(f"    {host}: skipped (host unreachable)", YELLOW)
+            probe_ok = False
+            continue
+        result = host_results.get(host, {'failed': True, 'msg': 'no result'})
+        print_colored(f"    {host}: {describe_result(result)}", NC)
+        if result.get('unreachable') or result.get('failed'):
+            probe_ok = False
+    
+    if probe_ok:
+        return True
     
-    inventory_file = ansible_dir / f"inventories/{environment}.yml"
+    print_colored(f"❌ Probe failed: {module} {describe_args(module_args)}".rstrip(), RED)
+    if fail_mode == "warn":
+        print_colored(f"    ⚠️ {description} may not be responding", YELLOW)
+        return True
+    return False
+
+def run_checks(rows, inventory_path: str, ansible_dir: str) -> List[str]:
+    """Run the selected probe rows and print a report per category; return the failed check names"""
+    categories = [category for category in CATEGORIES if any(row[0] == category[0] for row in rows)]
     
-    if not inventory_file.exists():
-        print_colored(f"❌ Inventory file not found: {inventory_file}", Colors.RED)
-        return False
+    # One ansible-playbook run covers every row: one interpreter start,
+    # one inventory parse and one SSH connection per host
+    results = run_health_playbook(rows, inventory_path, ansible_dir)
+    if results is None:
+        flush_output()
+        return [check_name for _, check_name, _ in categories]
     
-    # Check if services are responding on their ports
-    endpoints = [
-        ('Grafana (port 3000)', 'all -m uri -a "url=http://localhost:3000/api/health timeout=10"'),
-        ('Prometheus (port 9090)', 'all -m uri -a "url=http://localhost:9090/-/ready timeout=10"'),
-        ('Loki (port 3100)', 'all -m uri -a "url=http://localhost:3100/ready timeout=10"'),
-    ]
+    task_results, hosts, unreachable = collect_task_results(results)
     
-    success = True
-    for description, command in endpoints:
-        print_colored(f"  Checking {description}...", Colors.YELLOW)
-        if not run_ansible_command(command, inventory_file, ansible_dir):
-            print_colored(f"    ⚠️ {description} may not be responding", Colors.YELLOW)
-            # Don't fail the whole check for endpoint issues
+    failed_checks = []
+    for category, check_name, header in categories:
+        print_colored(f"\n--- Running {check_name} check ---", BLUE)
+        print_colored(header, BLUE)
+        try:
+            outcomes = [report_probe(row, task_results, hosts, unreachable) for row in rows if row[0] == category]
+            if not all(outcomes):
+                failed_checks.append(check_name)
+        except Exception as e:
+            print_colored(f"❌ {check_name} check failed with error: {e}", RED)
+            failed_checks.append(check_name)
+        flush_output()
     
-    return success
+    return failed_checks
 
 def main():
     """Main health check function"""
@@ -157,53 +227,47 @@ def main():
     
     args = parser.parse_args()
     
-    print_colored(f"🔍 Running health checks for environment: {args.environment}", Colors.BLUE)
-    
-    # Get project root directory
-    project_root = Path(__file__).parent.parent.parent
-    ansible_dir = project_root / "ansible"
+    print_colored(f"🔍 Running health checks for environment: {args.environment}", BLUE)
+    flush_output()
     
-    if not ansible_dir.exists():
-        print_colored(f"❌ Ansible directory not found: {ansible_dir}", Colors.RED)
+    if not ANSIBLE_DIR.exists():
+        print_colored(f"❌ Ansible directory not found: {ANSIBLE_DIR}", RED)
+        flush_output()
         sys.exit(1)
     
-    # Run all health checks
-    checks = [
-        ("connectivity", check_connectivity),
-        ("system resources", check_system_resources),
-        ("services", check_services),
-        ("docker containers", check_docker_containers),
-    ]
+    inventory_file = ANSIBLE_DIR / f"inventories/{args.environment}.yml"
     
-    if not args.skip_endpoints:
-        checks.append(("monitoring endpoints", check_monitoring_endpoints))
+    if not inventory_file.exists():
+        print_colored(f"❌ Inventory file not found: {inventory_file}", RED)
+        flush_output()
+        sys.exit(1)
     
-    failed_checks = []
+    # Resolve paths once and hand plain strings to every subprocess call
+    ansible_dir_str = str(ANSIBLE_DIR.resolve())
+    # Relative to the ansible directory, which is the cwd ansible-playbook runs in
+    inventory_path = str(inventory_file.relative_to(ANSIBLE_DIR))
     
-    for check_name, check_function in checks:
-        try:
-            print_colored(f"\n--- Running {check_name} check ---", Colors.BLUE)
-            if not check_function(args.environment, ansible_dir):
-                failed_checks.append(check_name)
-        except Exception as e:
-            print_colored(f"❌ {check_name} check failed with error: {e}", Colors.RED)
-            failed_checks.append(check_name)
+    # Select probe rows and run them all
+    rows = [row for row in CHECKS if not (args.skip_endpoints and row[0] == "endpoints")]
+    failed_checks = run_checks(rows, inventory_path, ansible_dir_str)
     
     # Print summary
-    print_colored("\n📊 Health Check Summary:", Colors.BLUE)
+    print_colored("\n📊 Health Check Summary:", BLUE)
     
     if not failed_checks:
-        print_colored("✅ All health checks passed!", Colors.GREEN)
+        print_colored("✅ All health checks passed!", GREEN)
+        flush_output()
         sys.exit(0)
     else:
-        print_colored(f"❌ {len(failed_checks)} health check(s) failed:", Colors.RED)
+        print_colored(f"❌ {len(failed_checks)} health check(s) failed:", RED)
         for check in failed_checks:
-            print_colored(f"  • {check}", Colors.RED)
+            print_colored(f"  • {check}", RED)
         
-        print_colored("\n💡 Tips:", Colors.YELLOW)
-        print_colored("  • Check server connectivity and SSH access", Colors.YELLOW)
-        print_colored("  • Verify services are running: systemctl status <service>", Colors.YELLOW)
-        print_colored("  • Check logs: journalctl -u <service> --tail 50", Colors.YELLOW)
+        print_colored("\n💡 Tips:", YELLOW)
+        print_colored("  • Check server connectivity and SSH access", YELLOW)
+        print_colored("  • Verify services are running: systemctl status <service>", YELLOW)
+        print_colored("  • Check logs: journalctl -u <service> --tail 50", YELLOW)
+        flush_output()
         
         sys.exit(1)
 
@@ -4,77 +4,146 @@ VPS Configuration Validation Script
 Python version of the bash validation script
 """
 
+import io
 import os
 import sys
+import shutil
 import subprocess
 import yaml
 import docker
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, List, Tuple
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # Color codes
-class Colors:
-    RED = '\033[0;31m'
-    GREEN = '\033[0;32m'
-    YELLOW = '\033[1;33m'
-    BLUE = '\033[0;34m'
-    NC = '\033[0m'
+RED = '\033[0;31m'
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'
 
-def print_colored(message: str, color: str = Colors.NC):
-    print(f"{color}{message}{Colors.NC}")
+def tally(results: List[int]) -> Tuple[int, int]:
+    """Turn a phase's 1/0 test results into (passed, failed) counts"""
+    return sum(results), len(results) - sum(results)
 
 class ValidationTest:
     def __init__(self):
-        self.tests_passed = 0
-        self.tests_failed = 0
         self.skip_docker_pull = os.getenv('SKIP_DOCKER_PULL', '').lower() == 'true'
+        self._docker = None
+        self._buf = io.StringIO()
+        
+    def print_colored(self, message: str, color: str = NC):
+        """Queue a colored line in the section buffer; flush_output() writes it out"""
+        self._buf.write(f"{color}{message}{NC}\n")
+    
+    def flush_output(self):
+        """Write the buffered section to stdout in one go"""
+        sys.stdout.write(self._buf.getvalue())
+        sys.stdout.flush()
+        self._buf.seek(0)
+        self._buf.truncate()
         
-    def run_test(self, test_name: str, command: str, cwd: Path = None, timeout: int = 30) -> bool:
-        """Run a test and track results"""
-        print(f"Testing {test_name}... ", end='', flush=True)
+    def run_phase(self, phase: Callable, *args) -> Tuple[int, int, str]:
+        """Run one validation phase on a fresh validator sharing this one's Docker client
+        
+        Returns the phase's (passed, failed, output) so phases can run concurrently
+        without sharing the output buffer.
+        """
+        section = ValidationTest()
+        section._docker = self._docker
+        passed, failed = phase(section, *args)
+        return passed, failed, section._buf.getvalue()
+    
+    def docker_client(self):
+        """Lazily connect to the Docker daemon through the SDK; None if it isn't reachable"""
+        if self._docker is None:
+            try:
+                client = docker.from_env()
+                client.ping()
+                self._docker = client
+            except Exception:
+                self._docker = False
+        return self._docker or None
+    
+    def run_test(self, test_name: str, command: List[str], cwd: Path = None, timeout: int = 30, capture: bool = False) -> int:
+        """Run a test command (argv list, no shell); return 1 if it passed, 0 if not
+
+        Output is discarded unless capture is set, in which case it is shown on failure.
+        """
+        self._buf.write(f"Testing {test_name}... ")
+        
+        output = subprocess.PIPE if capture else subprocess.DEVNULL
         
         try:
             result = subprocess.run(
                 command,
-                shell=True,
                 cwd=cwd,
-                capture_output=True,
+                stdout=output,
+                stderr=subprocess.STDOUT if capture else subprocess.DEVNULL,
                 text=True,
                 timeout=timeout
             )
             
             if result.returncode == 0:
-                print_colored("✓", Colors.GREEN)
-                self.tests_passed += 1
-                return True
+                self.print_colored("✓", GREEN)
+                return 1
             else:
-                print_colored("✗", Colors.RED)
-                self.tests_failed += 1
-                return False
+                self.print_colored("✗", RED)
+                if capture and result.stdout:
+                    self.print_colored(result.stdout.strip(), YELLOW)
+                return 0
                 
         except subprocess.TimeoutExpired:
-            print_colored("✗ (timeout)", Colors.RED)
-            self.tests_failed += 1
-            return False
+            self.print_colored("✗ (timeout)", RED)
+            return 0
         except Exception:
-            print_colored("✗", Colors.RED)
-            self.tests_failed += 1
-            return False
+            self.print_colored("✗", RED)
+            return 0
+    
+    def run_test_inproc(self, test_name: str, check: Callable[[], bool]) -> int:
+        """Run a test as an in-process check, without spawning a subprocess; return 1 if it passed, 0 if not"""
+        self._buf.write(f"Testing {test_name}... ")
+        
+        try:
+            passed = bool(check())
+        except Exception:
+            passed = False
+        
+        if passed:
+            self.print_colored("✓", GREEN)
+            return 1
+        else:
+            self.print_colored("✗", RED)
+            return 0
     
-    def check_prerequisites(self):
+    def check_prerequisites(self) -> Tuple[int, int]:
         """Check all prerequisites"""
-        print_colored("📋 Checking prerequisites...", Colors.BLUE)
+        self.print_colored("📋 Checking prerequisites...", BLUE)
         
-        self.run_test("Ansible installation", "command -v ansible-playbook")
-        self.run_test("Docker installation (for local testing)", "command -v docker")
-        self.run_test("uv installation", "command -v uv")
+        results = [
+            self.run_test_inproc("Ansible installation", lambda: shutil.which("ansible-playbook") is not None),
+            self.run_test_inproc("Docker installation (for local testing)", lambda: shutil.which("docker") is not None),
+            self.run_test_inproc("uv installation", lambda: shutil.which("uv") is not None),
+        ]
         
-        # Test Docker CLI access
-        self.run_test("Docker CLI access", "docker version --format '{{.Client.Version}}'", timeout=10)
+        # Test Docker access over the SDK connection, or via the CLI when the SDK can't reach the daemon
+        client = self.docker_client()
+        if client:
+            results.append(self.run_test_inproc("Docker daemon access", client.version))
+        else:
+            results.append(self.run_test("Docker CLI access", ["docker", "version", "--format", "{{.Client.Version}}"], timeout=10))
+        
+        return tally(results)
     
-    def check_file_structure(self, project_root: Path):
+    def check_file_structure(self, project_root: Path) -> Tuple[int, int]:
         """Check if all required files exist"""
-        print_colored("\n📁 Checking file structure...", Colors.BLUE)
+        self.print_colored("\n📁 Checking file structure...", BLUE)
         
         required_files = [
             "ansible/playbooks/site.yml",
@@ -85,55 +154,54 @@ class ValidationTest:
             "ansible/roles/caddy/templates/Caddyfile.j2"
         ]
         
+        # List each parent directory once instead of stat()ing every file
+        str_project_root = str(project_root)
+        present = set()
+        for directory in {os.path.dirname(file_path) for file_path in required_files}:
+            try:
+                with os.scandir(os.path.join(str_project_root, directory)) as entries:
+                    present.update(f"{directory}/{entry.name}" for entry in entries if entry.is_file())
+            except OSError:
+                pass
+        
+        results = []
         for file_path in required_files:
-            full_path = project_root / file_path
-            test_name = f"{Path(file_path).name} exists"
-            if full_path.exists():
-                print_colored(f"Testing {test_name}... ✓", Colors.GREEN)
-                self.tests_passed += 1
+            test_name = f"{os.path.basename(file_path)} exists"
+            if file_path in present:
+                self.print_colored(f"Testing {test_name}... ✓", GREEN)
+                results.append(1)
             else:
-                print_colored(f"Testing {test_name}... ✗", Colors.RED)
-                self.tests_failed += 1
-    
-    def validate_ansible_syntax(self, project_root: Path):
-        """Validate Ansible playbook syntax"""
-        print_colored("\n🔍 Validating Ansible syntax...", Colors.BLUE)
+                self.print_colored(f"Testing {test_name}... ✗", RED)
+                results.append(0)
         
-        ansible_dir = project_root / "ansible"
-        
-        # Determine inventory file
-        production_inventory = ansible_dir / "inventories/production.yml"
-        template_inventory = ansible_dir / "inventories/hosts.yml"
-        
-        if production_inventory.exists():
-            inventory_file = "inventories/production.yml"
-        else:
-            inventory_file = "inventories/hosts.yml"
-            print_colored("⚠️  Using template inventory for syntax check", Colors.YELLOW)
-        
-        command = f"ansible-playbook playbooks/site.yml --syntax-check -i {inventory_file}"
-        self.run_test("Playbook syntax", command, cwd=ansible_dir)
+        return tally(results)
     
-    def test_template_rendering(self, project_root: Path):
-        """Test template rendering if production inventory exists"""
+    def validate_ansible_playbook(self, project_root: Path) -> Tuple[int, int]:
+        """Validate the Ansible playbook, rendering templates when the production inventory exists"""
         ansible_dir = project_root / "ansible"
         production_inventory = ansible_dir / "inventories/production.yml"
         
-        if not production_inventory.exists():
-            print_colored("\n🎨 Skipping template rendering test (using template inventory)", Colors.BLUE)
+        if production_inventory.exists():
+            # A check run parses the whole playbook before rendering the caddy
+            # templates, so one ansible-playbook start covers both
+            self.print_colored("\n🔍 Validating Ansible syntax and template rendering...", BLUE)
+            command = ["ansible-playbook", "playbooks/site.yml", "--check", "--diff", "-t", "caddy", "-i", "inventories/production.yml"]
+            return tally([self.run_test("Playbook syntax and Caddyfile template", command, cwd=ansible_dir, capture=True)])
         else:
-            print_colored("\n🎨 Testing template rendering...", Colors.BLUE)
-            command = "ansible-playbook playbooks/site.yml --check -i inventories/production.yml -t caddy --diff"
-            self.run_test("Caddyfile template syntax", command, cwd=ansible_dir)
+            self.print_colored("\n🔍 Validating Ansible syntax...", BLUE)
+            self.print_colored("⚠️  Using template inventory for syntax check", YELLOW)
+            self.print_colored("🎨 Skipping template rendering test (using template inventory)", BLUE)
+            command = ["ansible-playbook", "playbooks/site.yml", "--syntax-check", "-i", "inventories/hosts.yml"]
+            return tally([self.run_test("Playbook syntax", command, cwd=ansible_dir, capture=True)])
     
-    def check_docker_images(self):
+    def check_docker_images(self) -> Tuple[int, int]:
         """Check Docker image availability"""
         if self.skip_docker_pull:
-            print_colored("\n🐳 Skipping Docker image pulls (SKIP_DOCKER_PULL=true)", Colors.BLUE)
-            return
+            self.print_colored("\n🐳 Skipping Docker image pulls (SKIP_DOCKER_PULL=true)", BLUE)
+            return 0, 0
             
-        print_colored("\n🐳 Checking Docker image availability...", Colors.BLUE)
-        print_colored("💡 Tip: Set SKIP_DOCKER_PULL=true to skip image pulling", Colors.YELLOW)
+        self.print_colored("\n🐳 Checking Docker image availability...", BLUE)
+        self.print_colored("💡 Tip: Set SKIP_DOCKER_PULL=true to skip image pulling", YELLOW)
         
         images = [
             "caddy:2-alpine",
@@ -144,12 +212,43 @@ class ValidationTest:
             "grafana/promtail:latest"
         ]
         
-        for image in images:
-            self.run_test(f"Docker image: {image}", f"docker pull {image}")
+        # Connect once up front rather than racing to do it from every worker
+        self.docker_client()
+        
+        # Pulls are network-bound, so run them all at once and report as each finishes
+        results = []
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            futures = [executor.submit(self._pull_image, image) for image in images]
+            for future in as_completed(futures):
+                image, ok = future.result()
+                if ok:
+                    self.print_colored(f"Testing Docker image: {image}... ✓", GREEN)
+                    results.append(1)
+                else:
+                    self.print_colored(f"Testing Docker image: {image}... ✗", RED)
+                    results.append(0)
+        
+        return tally(results)
     
-    def validate_config_files(self, project_root: Path):
+    def _pull_image(self, image: str) -> Tuple[str, bool]:
+        """Pull a single Docker image, returning (image, success)"""
+        client = self.docker_client()
+        try:
+            if client:
+                # One shared daemon connection instead of a docker CLI process per image
+                repository, _, tag = image.rpartition(':')
+                client.images.pull(repository, tag=tag)
+                return image, True
+            
+            # Fall back to the CLI when the SDK can't reach the daemon (e.g. a Colima context)
+            result = subprocess.run(["docker", "pull", image], capture_output=True, timeout=120)
+            return image, result.returncode == 0
+        except Exception:
+            return image, False
+    
+    def validate_config_files(self, project_root: Path) -> Tuple[int, int]:
         """Validate YAML configuration files"""
-        print_colored("\n⚙️ Validating configuration files...", Colors.BLUE)
+        self.print_colored("\n⚙️ Validating configuration files...", BLUE)
         
         template_dir = project_root / "ansible/roles/monitoring/templates"
         config_files = [
@@ -158,6 +257,7 @@ class ValidationTest:
             ("promtail.yml.j2", "Promtail config template")
         ]
         
+        results = []
         for filename, test_name in config_files:
             file_path = template_dir / filename
             if file_path.exists():
@@ -165,49 +265,70 @@ class ValidationTest:
                     with open(file_path, 'r') as f:
                         content = f.read()
                         # Basic YAML validation (templates may have Jinja2 vars)
-                        yaml.safe_load(content)
-                    print_colored(f"Testing {test_name}... ✓", Colors.GREEN)
-                    self.tests_passed += 1
+                        yaml.load(content, Loader=SafeLoader)
+                    self.print_colored(f"Testing {test_name}... ✓", GREEN)
+                    results.append(1)
                 except Exception:
                     # Templates with Jinja2 variables may not parse as pure YAML
-                    print_colored(f"Testing {test_name}... ⚠️ (template with variables)", Colors.YELLOW)
+                    self.print_colored(f"Testing {test_name}... ⚠️ (template with variables)", YELLOW)
             else:
-                print_colored(f"Testing {test_name}... ✗ (file not found)", Colors.RED)
-                self.tests_failed += 1
+                self.print_colored(f"Testing {test_name}... ✗ (file not found)", RED)
+                results.append(0)
+        
+        return tally(results)
     
-    def print_summary(self):
-        """Print test summary"""
-        print_colored("\n📊 Test Summary:", Colors.BLUE)
-        print_colored(f"✅ Passed: {self.tests_passed}", Colors.GREEN)
-        print_colored(f"❌ Failed: {self.tests_failed}", Colors.RED)
+    def print_summary(self, phase_results: List[Tuple[int, int]]):
+        """Print test summary from each phase's (passed, failed) counts"""
+        tests_passed = sum(passed for passed, _ in phase_results)
+        tests_failed = sum(failed for _, failed in phase_results)
         
-        if self.tests_failed == 0:
-            print_colored("\n🎉 All validation tests passed! Ready for deployment.", Colors.GREEN)
+        self.print_colored("\n📊 Test Summary:", BLUE)
+        self.print_colored(f"✅ Passed: {tests_passed}", GREEN)
+        self.print_colored(f"❌ Failed: {tests_failed}", RED)
+        
+        if tests_failed == 0:
+            self.print_colored("\n🎉 All validation tests passed! Ready for deployment.", GREEN)
             return True
         else:
-            print_colored("\n💥 Some validation tests failed. Please fix issues before deployment.", Colors.RED)
+            self.print_colored("\n💥 Some validation tests failed. Please fix issues before deployment.", RED)
             return False
 
 def main():
     """Main validation function"""
-    print_colored("🔍 Running pre-deployment validation...", Colors.BLUE)
+    # Initialize validator
+    validator = ValidationTest()
+    
+    validator.print_colored("🔍 Running pre-deployment validation...", BLUE)
+    validator.flush_output()
     
     # Get project root directory
     project_root = Path(__file__).parent.parent
     
-    # Initialize validator
-    validator = ValidationTest()
+    # Connect to Docker up front so every phase shares one client
+    validator.docker_client()
+    
+    phases = [
+        (ValidationTest.check_prerequisites, ()),
+        (ValidationTest.check_file_structure, (project_root,)),
+        (ValidationTest.validate_ansible_playbook, (project_root,)),
+        (ValidationTest.check_docker_images, ()),
+        (ValidationTest.validate_config_files, (project_root,)),
+    ]
     
-    # Run all validation steps
-    validator.check_prerequisites()
-    validator.check_file_structure(project_root)
-    validator.validate_ansible_syntax(project_root)
-    validator.test_template_rendering(project_root)
-    validator.check_docker_images()
-    validator.validate_config_files(project_root)
+    # Phases are independent, so run them all at once; each section is still
+    # written out in order as soon as it and everything before it has finished
+    with ThreadPoolExecutor(max_workers=len(phases)) as executor:
+        futures = [executor.submit(validator.run_phase, phase, *args) for phase, args in phases]
+        phase_results = []
+        for future in futures:
+            passed, failed, output = future.result()
+            phase_results.append((passed, failed))
+            sys.stdout.write(output)
+            sys.stdout.flush()
     
     # Print summary and exit
-    success = validator.print_summary()
+    success = validator.print_summary(phase_results)
+    validator.flush_output()
     sys.exit(0 if success else 1)
 
 if __name__ == "__main__":